@@ -26,8 +26,13 @@ import kineticstoolkit as ktk
 import numpy as np
 import pandas as pd
 import os
+import pytest
 import warnings
 
+# These tests write to the same files in the current folder; keep them on
+# the same worker when running in parallel with pytest-xdist.
+pytestmark = pytest.mark.xdist_group("files")
+
 
 def test_save_load():
     """Test the save and load functions."""
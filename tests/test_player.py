@@ -25,100 +25,203 @@ __email__ = "chenier.felix@uqam.ca"
 __license__ = "Apache 2.0"
 
 import kineticstoolkit as ktk
-import matplotlib.pyplot as plt
 import matplotlib as mpl
+import matplotlib.animation
+import matplotlib.pyplot as plt
 import numpy as np
+import functools
 import os
+import pytest
+
+# The Player tests use the Qt5Agg graphic aggregator. This sets the
+# interactive mode and therefore prevents a warning telling that Player must
+# be used in interactive mode. We only probe here that Matplotlib can switch
+# to it, then switch back; the backend itself is switched by _qt5agg_backend
+# for this module only, so that the plotting tests of the other modules keep
+# their usual backend.
+#
+# If it fails, it's ok, unless we are running on macOS. For weird reasons,
+# macOS headless mode on GitHub's continuous integration fails with bus
+# errors or segmentation faults. Since KTK is primlarily developed on macOS,
+# it does not bother me that the Player is not tested specifically on macOS
+# during continuous integration, because it is tested locally. It is still
+# tested on Linux and Windows, using the default backend when headless.
+_default_backend = mpl.get_backend()
+try:
+    plt.switch_backend("Qt5Agg")
+    _interactive_backend = True
+except ImportError:
+    _interactive_backend = False
+else:
+    plt.switch_backend(_default_backend)
+
+RUN_PLAYER_TESTS = _interactive_backend or not ktk.config.is_mac
+
+pytestmark = pytest.mark.skipif(
+    not RUN_PLAYER_TESTS, reason="no interactive backend"
+)
+
+# Pause duration between Player operations. It must stay positive: Matplotlib
+# runs the event loop forever on a zero timeout. Set KTK_INTERACTIVE=1 to
+# actually watch the tests.
+_PAUSE = 0.2 if os.environ.get("KTK_INTERACTIVE") else 0.001
+
+# Playback needs a longer pause so that the Player's timer (33 ms) fires.
+_PLAY_PAUSE = 0.5 if os.environ.get("KTK_INTERACTIVE") else 0.1
+
+
+@pytest.fixture(scope="module", autouse=True)
+def _qt5agg_backend():
+    """Use Qt5Agg for the Player tests, then restore the previous backend."""
+    if not _interactive_backend:
+        yield
+        return
+    previous_backend = mpl.get_backend()
+    plt.switch_backend("Qt5Agg")
+    yield
+    plt.close("all")
+    plt.switch_backend(previous_backend)
+
+
+@pytest.fixture(scope="session")
+def tennis_markers() -> ktk.TimeSeries:
+    """Read the tennis serve markers once per test session."""
+    return ktk.read_c3d(ktk.doc.download("kinematics_tennis_serve.c3d"))[
+        "Points"
+    ]
+
+
+@pytest.fixture(scope="session")
+def inv_dyn_kin() -> dict:
+    """Load the inverse dynamics kinematics once per test session."""
+    return ktk.load(ktk.doc.download("inversedynamics_kinematics.ktk.zip"))[
+        "Kinematics"
+    ]
+
+
+# Segment definitions shared by the tests, built once at import
+_INTERCONNECTIONS = dict()
+
+_INTERCONNECTIONS["LLowerLimb"] = {
+    "Color": [0, 0.5, 1],  # In RGB format (here, greenish blue)
+    "Links": [  # List of lines that span lists of markers
+        ["*LTOE", "*LHEE", "*LANK", "*LTOE"],
+        ["*LANK", "*LKNE", "*LASI"],
+        ["*LKNE", "*LPSI"],
+    ],
+}
+
+_INTERCONNECTIONS["RLowerLimb"] = {
+    "Color": [0, 0.5, 1],
+    "Links": [
+        ["*RTOE", "*RHEE", "*RANK", "*RTOE"],
+        ["*RANK", "*RKNE", "*RASI"],
+        ["*RKNE", "*RPSI"],
+    ],
+}
+
+_INTERCONNECTIONS["LUpperLimb"] = {
+    "Color": [0, 0.5, 1],
+    "Links": [
+        ["*LSHO", "*LELB", "*LWRA", "*LFIN"],
+        ["*LELB", "*LWRB", "*LFIN"],
+        ["*LWRA", "*LWRB"],
+    ],
+}
+
+_INTERCONNECTIONS["RUpperLimb"] = {
+    "Color": [1, 0.5, 0],
+    "Links": [
+        ["*RSHO", "*RELB", "*RWRA", "*RFIN"],
+        ["*RELB", "*RWRB", "*RFIN"],
+        ["*RWRA", "*RWRB"],
+    ],
+}
+
+_INTERCONNECTIONS["Head"] = {
+    "Color": [1, 0.5, 1],
+    "Links": [
+        ["*C7", "*LFHD", "*RFHD", "*C7"],
+        ["*C7", "*LBHD", "*RBHD", "*C7"],
+        ["*LBHD", "*LFHD"],
+        ["*RBHD", "*RFHD"],
+    ],
+}
+
+_INTERCONNECTIONS["TrunkPelvis"] = {
+    "Color": [0.5, 1, 0.5],
+    "Links": [
+        ["*LASI", "*STRN", "*RASI"],
+        ["*STRN", "*CLAV"],
+        ["*LPSI", "*T10", "*RPSI"],
+        ["*T10", "*C7"],
+        ["*LASI", "*LSHO", "*LPSI"],
+        ["*RASI", "*RSHO", "*RPSI"],
+        [
+            "*LPSI",
+            "*LASI",
+            "*RASI",
+            "*RPSI",
+            "*LPSI",
+        ],
+        [
+            "*LSHO",
+            "*CLAV",
+            "*RSHO",
+            "*C7",
+            "*LSHO",
+        ],
+    ],
+}
 
-
-def init() -> bool:
-    """
-    Initialize the graphic aggrator to Qt5Agg.
-
-    This tries to ask Matplotlib to use Qt5Agg, which sets the interactive
-    mode and therefore prevents a warning telling that Player must be used
-    in interactive mode.
-
-    If it fails, it's ok, unless we are running on macOS. For weird reasons,
-    macOS headless mode on GitHub's continuous integration fails with bus
-    errors or segmentation faults. Since KTK is primlarily developed on macOS,
-    it does not bother me that the Player is not tested specifically on macOS
-    during continuous integration, because it is tested locally. It is still
-    tested on Linux and Windows.
-
-    Returns
-    -------
-    bool
-        True if the test must be run, False if it must not be run.
-
-    """
-    try:
-        mpl.use("Qt5Agg")
-    except ImportError:
-        if ktk.config.is_mac:
-            return False
-    return True
+_HEAD_SEGMENT = {"Head": _INTERCONNECTIONS["Head"]}
 
 
-def test_instanciate():
+def test_instanciate(inv_dyn_kin):
     """Test that instanciating a Player does not crash."""
-    if not init():
-        return
-
-    # Load markers
-    kinematics = ktk.load(
-        ktk.doc.download("inversedynamics_kinematics.ktk.zip")
-    )
-
-    kinematics = kinematics["Kinematics"]
+    kinematics = inv_dyn_kin
 
-    # The player can be instanciated to show markers
-    pl = ktk.Player(kinematics["Markers"], target=[-5, 0, 0])
-    plt.pause(0.2)
-    pl.close()
+    markers = kinematics["Markers"]
+    frames = kinematics["ReferenceFrames"]
 
     # The player can be instanciated to show rigid bodies
-    pl = ktk.Player(kinematics["ReferenceFrames"], target=[-5, 0, 0])
-    plt.pause(0.2)
+    pl = ktk.Player(frames, target=[-5, 0, 0])
+    plt.pause(_PAUSE)
+    assert set(frames.data) <= set(pl._oriented_frames.data)
+    assert "Origin" in pl._oriented_frames.data
+    assert len(pl._oriented_points.data) == 0
+
+    # The same player can then show markers
+    pl.up = "z"
+    pl.set_contents(markers)
+    plt.pause(_PAUSE)
+    assert set(markers.data) <= set(pl._oriented_points.data)
+    assert set(pl._oriented_frames.data) == {"Origin"}
+
+    # Or both markers and rigid bodies
+    pl.set_contents(markers.merge(frames))
+    plt.pause(_PAUSE)
+    assert set(markers.data) <= set(pl._oriented_points.data)
+    assert set(frames.data) <= set(pl._oriented_frames.data)
+    assert "Origin" in pl._oriented_frames.data
     pl.close()
 
-    # Or the player can be instanciated to show both markers and rigid bodies
-    pl = ktk.Player(
-        kinematics["Markers"],
-        kinematics["ReferenceFrames"],
-        target=[-5, 0, 0],
-        up="z",
-    )
-    plt.pause(0.2)
-
 
-def test_issue137():
+def test_issue137(inv_dyn_kin):
     """
     Player should not fail if some TimeSeries are not Nx4 or Nx4x4
     """
-    if not init():
-        return
-
-    kinematics = ktk.load(
-        ktk.doc.download("inversedynamics_kinematics.ktk.zip")
-    )
-    kinematics = kinematics["Kinematics"]["Markers"]
+    kinematics = inv_dyn_kin["Markers"].copy()
     kinematics.data["test"] = kinematics.time
     pl = ktk.Player(kinematics)  # Shouldn't crash
-    plt.pause(0.2)
+    plt.pause(_PAUSE)
     pl.close()
 
 
-def test_scripting():
+def test_scripting(tennis_markers):
     """Test that every property assignation works or crashes as expected."""
-    # %%
-    # Download and read markers from a sample C3D file
-    if not init():
-        return
-    # %%
-
-    filename = ktk.doc.download("kinematics_tennis_serve.c3d")
-    markers = ktk.read_c3d(filename)["Points"]
+    # Keep only seconds 4 to 5 so that every refresh stays cheap
+    markers = tennis_markers.get_ts_between_times(4.0, 5.0)
 
     # Create another person
     markers2 = markers.copy()
@@ -129,87 +232,13 @@ def test_scripting():
             key, key.replace("Derrick", "Viktor"), in_place=True
         )
 
-    interconnections = dict()  # Will contain all segment definitions
-
-    interconnections["LLowerLimb"] = {
-        "Color": [0, 0.5, 1],  # In RGB format (here, greenish blue)
-        "Links": [  # List of lines that span lists of markers
-            ["*LTOE", "*LHEE", "*LANK", "*LTOE"],
-            ["*LANK", "*LKNE", "*LASI"],
-            ["*LKNE", "*LPSI"],
-        ],
-    }
-
-    interconnections["RLowerLimb"] = {
-        "Color": [0, 0.5, 1],
-        "Links": [
-            ["*RTOE", "*RHEE", "*RANK", "*RTOE"],
-            ["*RANK", "*RKNE", "*RASI"],
-            ["*RKNE", "*RPSI"],
-        ],
-    }
-
-    interconnections["LUpperLimb"] = {
-        "Color": [0, 0.5, 1],
-        "Links": [
-            ["*LSHO", "*LELB", "*LWRA", "*LFIN"],
-            ["*LELB", "*LWRB", "*LFIN"],
-            ["*LWRA", "*LWRB"],
-        ],
-    }
-
-    interconnections["RUpperLimb"] = {
-        "Color": [1, 0.5, 0],
-        "Links": [
-            ["*RSHO", "*RELB", "*RWRA", "*RFIN"],
-            ["*RELB", "*RWRB", "*RFIN"],
-            ["*RWRA", "*RWRB"],
-        ],
-    }
-
-    interconnections["Head"] = {
-        "Color": [1, 0.5, 1],
-        "Links": [
-            ["*C7", "*LFHD", "*RFHD", "*C7"],
-            ["*C7", "*LBHD", "*RBHD", "*C7"],
-            ["*LBHD", "*LFHD"],
-            ["*RBHD", "*RFHD"],
-        ],
-    }
-
-    interconnections["TrunkPelvis"] = {
-        "Color": [0.5, 1, 0.5],
-        "Links": [
-            ["*LASI", "*STRN", "*RASI"],
-            ["*STRN", "*CLAV"],
-            ["*LPSI", "*T10", "*RPSI"],
-            ["*T10", "*C7"],
-            ["*LASI", "*LSHO", "*LPSI"],
-            ["*RASI", "*RSHO", "*RPSI"],
-            [
-                "*LPSI",
-                "*LASI",
-                "*RASI",
-                "*RPSI",
-                "*LPSI",
-            ],
-            [
-                "*LSHO",
-                "*CLAV",
-                "*RSHO",
-                "*C7",
-                "*LSHO",
-            ],
-        ],
-    }
-
     # In this file, the up axis is z:
     p = ktk.Player(
         markers,
         markers2,
         up="z",
         anterior="-y",
-        interconnections=interconnections,
+        interconnections=_INTERCONNECTIONS,
     )
 
     # Check that the leading wildcard propagated well to the two subjects
@@ -377,12 +406,12 @@ def test_scripting():
     # %% Put back interconnections
     p.set_interconnections(inter)
 
-    # %% Keep only seconds 4 to 5
-    p.set_contents(markers.get_ts_between_times(4.0, 5.0))
+    # %% Keep only the first person
+    p.set_contents(markers)
 
     # %% Play and pause
     p.play()
-    plt.pause(0.5)
+    plt.pause(_PLAY_PAUSE)
     p.pause()
 
     # %% Close
@@ -391,40 +420,41 @@ def test_scripting():
     # %%
 
 
-def test_set_current_time():
+def test_set_current_time(tennis_markers):
     """Test that setting the current time on construction works."""
-    if not init():
-        return
-
-    filename = ktk.doc.download("kinematics_tennis_serve.c3d")
-    markers = ktk.read_c3d(filename)["Points"]
-    ktk.Player(markers, current_time=2.5)
+    ktk.Player(tennis_markers, current_time=2.5)
 
 
-def test_to_image_video():
+def test_to_image_video(tennis_markers, tmp_path, monkeypatch):
     """Test that to_image and to_video work."""
-    if not init():
-        return
+    # The output is discarded, so encode as fast as possible.
+    monkeypatch.setattr(
+        matplotlib.animation,
+        "FFMpegWriter",
+        functools.partial(
+            matplotlib.animation.FFMpegWriter,
+            extra_args=[
+                "-preset",
+                "ultrafast",
+                "-tune",
+                "zerolatency",
+            ],
+        ),
+    )
+    video_file = str(tmp_path / "test.mp4")
+    image_file = str(tmp_path / "test.png")
+
+    p = ktk.Player(tennis_markers.get_ts_between_times(0, 0.1))
+    p.to_video(video_file)
+    p.to_video(video_file, fps=30)
+    p.to_video(video_file, fps=30, downsample=4)
+    p.to_image(image_file)
+    assert os.path.exists(video_file)
+    assert os.path.exists(image_file)
 
-    filename = ktk.doc.download("kinematics_tennis_serve.c3d")
-    markers = ktk.read_c3d(filename)["Points"]
-    p = ktk.Player(markers.get_ts_between_times(0, 0.1))
-    p.to_video("test.mp4")
-    p.to_video("test.mp4", fps=30)
-    p.to_video("test.mp4", fps=30, downsample=4)
-    p.to_image("test.png")
-    assert os.path.exists("test.mp4")
-    assert os.path.exists("test.png")
-    os.remove("test.mp4")
-    os.remove("test.png")
-
-
-def test_interconnection_wildcards_as_suffix():
-    if not init():
-        return
 
-    filename = ktk.doc.download("kinematics_tennis_serve.c3d")
-    markers = ktk.read_c3d(filename)["Points"]
+def test_interconnection_wildcards_as_suffix(tennis_markers):
+    markers = tennis_markers.copy()
     keys = list(markers.data.keys())
     for key in keys:
         markers.data[key] += [[2.0, 2.0, 0.0, 0.0]]
@@ -631,35 +661,17 @@ def test_interconnection_wildcards_as_suffix():
     p.close()
 
 
-def test_old_parameter_names():
+def test_old_parameter_names(tennis_markers):
     """Test the old parameter names."""
-    if not init():
-        return
-
-    filename = ktk.doc.download("kinematics_tennis_serve.c3d")
-    markers = ktk.read_c3d(filename)["Points"]
-
     p = ktk.Player(
-        markers,
-        segments={
-            "Head": {
-                "Color": [1, 0.5, 1],
-                "Links": [
-                    ["*C7", "*LFHD", "*RFHD", "*C7"],
-                    ["*C7", "*LBHD", "*RBHD", "*C7"],
-                    ["*LBHD", "*LFHD"],
-                    ["*RBHD", "*RFHD"],
-                ],
-            }
-        },
+        tennis_markers,
+        segments=_HEAD_SEGMENT,
         segment_width=0,
         current_frame=10,
     )
-    plt.pause(0.2)
+    plt.pause(_PAUSE)
     p.close()
 
 
 if __name__ == "__main__":
-    import pytest
-
     pytest.main([__file__])